@@ -569,7 +569,7 @@ class AlertsScreen(Screen):
         """A message to close the selected alert"""
 
     class GetAlertsList(Message):
-        """A message to fetch alerts list"""
+        """A message to fetch alerts list, alerts count and on call member"""
 
         def __init__(
             self,
@@ -582,16 +582,6 @@ class AlertsScreen(Screen):
             self.filter_name = filter_name
             super().__init__()
 
-    class GetWhoisOnCall(Message):
-        """A message to get the team member who is on call"""
-
-    class GetAlertsCount(Message):
-        """A message to get total count of alerts matching the current filter"""
-
-        def __init__(self, parameters: dict = {}):
-            self.parameters = parameters
-            super().__init__()
-
     class TagAlert(Message):
         """A message to tag the selected alert"""
 
@@ -752,14 +742,20 @@ class AlertsScreen(Screen):
         asyncio.create_task(alert_note.get_alert_notes(opsgenie_id))
         asyncio.create_task(raw_alert_details.get_alert_detail(opsgenie_id))
 
-    @on(GetWhoisOnCall)
-    async def get_whois_on_call(self, message: GetWhoisOnCall):
-        on_call_schedule_ids = ty_config.opsgenie.get("on_call_schedule_ids", [])
+    async def _update_whois_on_call(self, on_call_schedule_ids: list, first_result):
+        """Find the on call member, first_result is the lookup of the first schedule
+
+        Other schedules are only looked up one after the other until one of them
+        has a recipient.
+        """
         self.current_on_call_member = ""
-        for on_call_schedule_id in on_call_schedule_ids:
-            result = await client.api.whois_on_call(
-                parameters={"identifier": on_call_schedule_id}
-            )
+        for index, on_call_schedule_id in enumerate(on_call_schedule_ids):
+            if index == 0:
+                result = first_result
+            else:
+                result = await client.api.whois_on_call(
+                    parameters={"identifier": on_call_schedule_id}
+                )
             if result is not None and len(result.data.on_call_recipients):
                 self.current_on_call_member = re.sub(
                     "@.*$", "", result.data.on_call_recipients[0]
@@ -780,6 +776,7 @@ class AlertsScreen(Screen):
             previous=message.previous,
             next=message.next,
             filter_name=message.filter_name,
+            refresh=True,
         )
 
     async def _get_alerts_list(
@@ -787,6 +784,7 @@ class AlertsScreen(Screen):
         previous: bool = False,
         next: bool = False,
         filter_name: str | None = None,
+        refresh: bool = False,
     ):
         parameters = self.opsgenie_query.current
         new_filter = False
@@ -907,7 +905,28 @@ class AlertsScreen(Screen):
                 # First time data are lookup, now we can flag the app as started
                 self.app.started = True
 
-        alerts = await client.api.list_alerts(parameters=parameters)
+        if refresh:
+            # Fetch alerts count and the first on call schedule along with the
+            # alerts list
+            on_call_schedule_ids = ty_config.opsgenie.get("on_call_schedule_ids", [])
+            calls = [
+                (client.api.list_alerts, {"parameters": parameters}),
+                (client.api.count_alerts, {"parameters": parameters}),
+            ]
+            if on_call_schedule_ids:
+                calls.append(
+                    (
+                        client.api.whois_on_call,
+                        {"parameters": {"identifier": on_call_schedule_ids[0]}},
+                    )
+                )
+            alerts, count, *on_call = await client.api.gather_calls(calls)
+            self._update_alerts_count(count)
+            await self._update_whois_on_call(
+                on_call_schedule_ids, on_call[0] if on_call else None
+            )
+        else:
+            alerts = await client.api.list_alerts(parameters=parameters)
 
         if alerts is not None:
             _update_data_table(alerts)
@@ -925,10 +944,7 @@ class AlertsScreen(Screen):
                 self.NotifyMessage(message="Unable to get alert list", severity="error")
             )
 
-    @on(GetAlertsCount)
-    async def get_alerts_count(self, message):
-        parameters = self.opsgenie_query.current
-        result = await client.api.count_alerts(parameters=parameters)
+    def _update_alerts_count(self, result):
         if result is not None:
             self.total_alerts = result.data.count
         else:
@@ -958,8 +974,6 @@ class AlertsScreen(Screen):
                 filter_name=filter_name,
             )
         )
-        self.post_message(self.GetAlertsCount())
-        self.post_message(self.GetWhoisOnCall())
 
     @on(DesktopNotify)
     async def desktop_notify(self, event):
@@ -1446,6 +1460,9 @@ class TygenieApp(App):
             )
         self.theme = ty_config.tygenie.get("theme", "flexoki")
 
+    async def on_unmount(self):
+        await client.aclose()
+
 
 def main() -> None:
     parser = argparse.ArgumentParser()
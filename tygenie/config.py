@@ -2,6 +2,7 @@ import json
 import os
 import pathlib
 import shutil
+from collections.abc import Callable
 
 CONFIG_DIR = pathlib.Path.home() / ".config" / "tygenie"
 CONFIG_FILE = "tygenie.json"
@@ -18,6 +19,7 @@ class Config:
         self.tygenie: dict = {}
         self.opsgenie: dict = {}
         self.sample_copied: bool = False
+        self.load_callbacks: list[Callable[["Config"], None]] = []
 
         super().__init__()
         self.__init__config()
@@ -43,6 +45,13 @@ class Config:
     def _load_config(self):
         self.tygenie = self.config.get("tygenie", {})
         self.opsgenie = self.config.get("opsgenie", {})
+        for callback in self.load_callbacks:
+            callback(self)
+
+    def register_load_callback(self, callback: Callable[["Config"], None]):
+        """Register a callback called each time the configuration is (re)loaded"""
+        self.load_callbacks.append(callback)
+        callback(self)
 
     def load(self):
         with open(self.config_path, "r") as conf:
@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 
 import asyncio
-import pendulum
-from httpx import Timeout
+import functools
+import math
+import random
+import threading
+import time
+import orjson
+from collections.abc import Callable
+from datetime import datetime, timezone
+from httpx import (
+    ConnectError,
+    ConnectTimeout,
+    HTTPError,
+    Limits,
+    PoolTimeout,
+    Response,
+    Timeout,
+)
 from textual import log
 
 import tygenie.consts as c
 
-from tygenie.config import ty_config
+from tygenie.config import Config, ty_config
 from tygenie.opsgenie_rest_api_client import AuthenticatedClient
 from tygenie.opsgenie_rest_api_client.models.add_tags_to_alert_payload import (
     AddTagsToAlertPayload,
@@ -33,154 +48,462 @@ from tygenie.opsgenie_rest_api_client.api.who_is_on_call import (
 )
 from tygenie.opsgenie_rest_api_client.api.account import get_info
 
+# asyncio_detailed endpoint functions resolved once, indexed by endpoint module
+_ASYNC = {
+    resource: resource.asyncio_detailed
+    for resource in (
+        add_note,
+        add_tags,
+        close_alert,
+        list_alerts,
+        count_alerts,
+        get_alert,
+        list_notes,
+        acknowledge_alert,
+        remove_tags,
+        un_acknowledge_alert,
+        list_schedules,
+        get_on_calls,
+        get_info,
+    )
+}
+
 __all__ = (
     "OpsGenie",
     "client",
 )
 
+# Authenticated clients shared across OpsGenie instances, keyed by (host, api_key)
+# so that a configuration reload does not rebuild the connection pool
+_client_cache: dict[tuple[str, str], AuthenticatedClient] = {}
+
+# api_call retries calls rejected by rate limiting or unavailability, and
+# calls which could not be sent. Other errors are not retried as the request
+# may have been processed (eg. a note added twice).
+API_CALL_ATTEMPTS = 3
+API_CALL_MAX_RETRY_DELAY = 10.0
+RETRYABLE_STATUS_CODES = (429, 503)
+RETRYABLE_EXCEPTIONS = (ConnectError, ConnectTimeout, PoolTimeout)
+# Errors of a call that failed or returned an unexpected payload: ValueError
+# covers JSON decoding errors, KeyError, TypeError and AttributeError are
+# raised by the generated from_dict parsing. A TypeError raised by invalid
+# arguments of the call itself is not caught, neither is anything else
+# including cancellation of the calling task.
+API_CALL_EXCEPTIONS = (HTTPError, ValueError, KeyError, TypeError, AttributeError)
+
+
+def _orjson_loads(response: Response, **kwargs) -> object:
+    return orjson.loads(response.content)
+
+
+async def _use_orjson_decoder(response: Response) -> None:
+    """httpx response hook making response.json() decode with orjson
+
+    Generated endpoints parse bodies with response.json(), orjson is much
+    faster than the json module on large alerts lists.
+    """
+    response.json = functools.partial(_orjson_loads, response)
+
+
+class ApiLogWriter:
+    """Write log lines from a single background task holding the log file open"""
+
+    def __init__(self) -> None:
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+        self.task: asyncio.Task | None = None
+        # Lines taken from the queue and not written yet, only modified while
+        # holding lock so that a write running in a thread and the final
+        # flush on shutdown do not overlap
+        self.pending: list[tuple[str, str]] = []
+        self.lock = threading.Lock()
+
+    def write(self, path: str, line: str) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (eg. at startup), write synchronously
+            self._write_sync(path, line)
+            return
+
+        if self.loop is not loop or self.task is None or self.task.done():
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.task = loop.create_task(self._writer())
+        self.queue.put_nowait((path, line))
+
+    def _write_sync(self, path: str, line: str) -> None:
+        try:
+            with open(path, "a") as f:
+                f.write(line)
+        except Exception as e:
+            log(f"Unable to log in file: {e}")
+
+    def _write_pending(self, f, count: int) -> None:
+        with self.lock:
+            # The writer task may have been stopped before this thread ran
+            if f.closed:
+                return
+            f.write("".join(line for _, line in self.pending[:count]))
+            f.flush()
+            del self.pending[:count]
+
+    async def _writer(self) -> None:
+        f = None
+        current_path = None
+        try:
+            while True:
+                # Wait for a line then take every line queued meanwhile
+                entry = await self.queue.get()
+                with self.lock:
+                    self.pending.append(entry)
+                    while not self.queue.empty():
+                        self.pending.append(self.queue.get_nowait())
+
+                while self.pending:
+                    # Write the leading lines going to the same file at once
+                    path = self.pending[0][0]
+                    count = 1
+                    while count < len(self.pending) and self.pending[count][0] == path:
+                        count += 1
+                    try:
+                        # File operations are blocking, keep them off the loop
+                        if f is None or path != current_path:
+                            if f is not None:
+                                await asyncio.to_thread(f.close)
+                                f = None
+                            f = await asyncio.to_thread(open, path, "a")
+                            current_path = path
+                        await asyncio.to_thread(self._write_pending, f, count)
+                    except Exception as e:
+                        log(f"Unable to log in file: {e}")
+                        with self.lock:
+                            del self.pending[:count]
+        finally:
+            # Wait for a write still running in a thread, then write
+            # synchronously the lines not written yet and the ones queued
+            # while the loop is shutting down
+            with self.lock:
+                if f is not None:
+                    f.close()
+                while not self.queue.empty():
+                    self.pending.append(self.queue.get_nowait())
+                for path, line in self.pending:
+                    self._write_sync(path, line)
+                self.pending.clear()
+
+
+api_log_writer = ApiLogWriter()
+
+
+# Resolved on each configuration load, check _LOG_ENABLED before calling
+# ApiLog to avoid formatting messages when logging is disabled
+_LOG_ENABLED: bool = False
+_LOG_FILE: str = "/tmp/tygenie.log"
+
+
+def _load_log_config(config: Config) -> None:
+    global _LOG_ENABLED, _LOG_FILE
+    log_config = config.tygenie.get("log", {"enable": False})
+    _LOG_ENABLED = bool(log_config.get("enable", True))
+    _LOG_FILE = log_config.get("file", "/tmp/tygenie.log")
+
+
+ty_config.register_load_callback(_load_log_config)
 
-def ApiLog(message: str = "") -> None:
-    if not message:
-        return
 
-    log_config = ty_config.tygenie.get("log", {"enable": False})
-    if "enable" in log_config and not log_config["enable"]:
+def ApiLog(message: str = "") -> None:
+    if not message or not _LOG_ENABLED:
         return
 
-    date = pendulum.now()
+    date = time.strftime("%Y-%m-%d %H:%M:%S%z")
     logline = f"[{date}] {message}"
     # Logline visble in textual console: textual console -vvv
     # and run app.py file with textual run app.py --dev
     log(f"{logline}")
-    try:
-        with open(log_config.get("file", "/tmp/tygenie.log"), "a") as f:
-            f.write(logline + "\n")
-    except Exception as e:
-        log(f"Unable to log in file: {e}")
-        pass
+    api_log_writer.write(_LOG_FILE, logline + "\n")
 
 
 class OpsGenie:
 
-    def __init__(self, api_key: str = "", host: str = "", username: str = ""):
+    def __init__(
+        self,
+        api_key: str = "",
+        host: str = "",
+        username: str = "",
+        client: AuthenticatedClient | None = None,
+    ):
         self.api_key = api_key
         self.host = host
         self.username = username
         self.source = "TyGenie {}".format(c.VERSION)
-        self.client = AuthenticatedClient(
+        self._payload_base = {"user": self.username, "source": self.source}
+        self.client = client or AuthenticatedClient(
             base_url=self.host,
             token=self.api_key,
             prefix="GenieKey",
             timeout=Timeout(5.0, connect=10.0),
+            # Keep connections (and TLS sessions) alive between two refreshes
+            httpx_args={
+                "limits": Limits(
+                    max_connections=40,
+                    max_keepalive_connections=20,
+                    keepalive_expiry=30.0,
+                ),
+                "http2": True,
+                "event_hooks": {"response": [_use_orjson_decoder]},
+            },
         )
+        # asyncio_detailed endpoint functions bound to this client
+        self._endpoints: dict = {
+            resource: functools.partial(endpoint, client=self.client)
+            for resource, endpoint in _ASYNC.items()
+        }
+        # (resource name, kwargs) => (expiration time, task of the API call)
+        self._cache: dict[tuple, tuple[float, asyncio.Future]] = {}
+
+    async def aclose(self):
+        # The httpx client is built lazily, only close it if it was used
+        if self.client._async_client is not None:
+            await self.client._async_client.aclose()
+
+    async def _cached_call(self, resource, ttl: float, **kwargs):
+        """Call the API unless a result for the same call is still fresh
+
+        Concurrent identical calls share the same in-flight request, with a
+        ttl of 0 only in-flight requests are shared. Failed calls (None
+        result) are not cached.
+        """
+        key = (resource.__name__, tuple(sorted(kwargs.items())))
+        cached = self._cache.get(key)
+        if cached is not None and (
+            not cached[1].done() or time.monotonic() < cached[0]
+        ):
+            return await asyncio.shield(cached[1])
+
+        task = asyncio.ensure_future(self.api_call(resource, **kwargs))
+        self._cache[key] = (math.inf, task)
+
+        def _on_done(task: asyncio.Future) -> None:
+            if self._cache.get(key, (0.0, None))[1] is not task:
+                return
+            if (
+                ttl <= 0
+                or task.cancelled()
+                or task.exception()
+                or task.result() is None
+            ):
+                self._cache.pop(key, None)
+            else:
+                self._cache[key] = (time.monotonic() + ttl, task)
 
-    async def get_account_info(self):
-        return await self.api_call(get_info)
-
-    async def count_alerts(self, parameters: dict = {}):
-        params = {"query": parameters.get("query", "")}
-        return await self.api_call(count_alerts, **params)
+        task.add_done_callback(_on_done)
+        return await asyncio.shield(task)
 
-    async def list_alerts(self, limit: int = 50, parameters: dict = {}):
-        params = {"limit": limit, "sort": "updatedAt", "order": "desc", "query": ""}
-        params.update(parameters)
-        return await self.api_call(list_alerts, **params)
+    def _invalidate_cache(self, *resources) -> None:
+        names = {resource.__name__ for resource in resources}
+        for key in [k for k in self._cache if k[0] in names]:
+            self._cache.pop(key, None)
 
-    async def get_alert(self, parameters: dict = {}):
-        return await self.api_call(get_alert, **parameters)
+    async def _alert_update_call(self, resource, **kwargs):
+        """api_call for calls updating an alert
 
-    async def get_alert_notes(self, parameters: dict = {}):
-        return await self.api_call(list_notes, **parameters)
+        Cached counts and in-flight alert reads started before or during the
+        update would return outdated data, drop them on both sides of the call.
+        """
+        self._invalidate_cache(count_alerts, get_alert, list_notes)
+        try:
+            return await self.api_call(resource, **kwargs)
+        finally:
+            self._invalidate_cache(count_alerts, get_alert, list_notes)
 
-    async def ack_alert(self, parameters: dict = {}, note: str = ""):
-        body = AlertActionPayload(user=self.username, source=self.source, note=note)
-        parameters["body"] = body
-        return await self.api_call(acknowledge_alert, **parameters)
+    async def get_account_info(self):
+        return await self.api_call(get_info)
 
-    async def add_note(self, parameters: dict = {}, note: str = ""):
-        body = AlertActionPayload(user=self.username, source=self.source, note=note)
-        parameters["body"] = body
-        ApiLog(f"opsgenie call add_note with params: {parameters}")
-        return await self.api_call(add_note, **parameters)
+    async def count_alerts(self, parameters: dict | None = None):
+        query = parameters.get("query", "") if parameters else ""
+        # Only share in-flight calls, the count must match the alerts list
+        # fetched along with it
+        return await self._cached_call(count_alerts, ttl=0, query=query)
 
-    async def unack_alert(self, parameters: dict = {}, note: str = ""):
-        body = AlertActionPayload(user=self.username, source=self.source, note=note)
-        parameters["body"] = body
-        return await self.api_call(un_acknowledge_alert, **parameters)
+    async def list_alerts(self, limit: int = 50, parameters: dict | None = None):
+        params = {"limit": limit, "sort": "updatedAt", "order": "desc", "query": ""}
+        if parameters:
+            params.update(parameters)
+        return await self.api_call(list_alerts, **params)
 
-    async def close_alert(self, parameters: dict = {}, note: str = ""):
-        body = AlertActionPayload(
-            user=self.username, source="TyGenie {}".format(c.VERSION), note=note
+    async def get_alert(self, parameters: dict | None = None):
+        parameters = parameters or {}
+        # Highlighting rows quickly asks for the same alert several times
+        return await self._cached_call(get_alert, ttl=0, **parameters)
+
+    async def get_alert_notes(self, parameters: dict | None = None):
+        parameters = parameters or {}
+        return await self._cached_call(list_notes, ttl=0, **parameters)
+
+    async def ack_alert(self, parameters: dict | None = None, note: str = ""):
+        parameters = parameters or {}
+        body = AlertActionPayload(note=note, **self._payload_base)
+        return await self._alert_update_call(acknowledge_alert, body=body, **parameters)
+
+    async def add_note(self, parameters: dict | None = None, note: str = ""):
+        parameters = parameters or {}
+        body = AlertActionPayload(note=note, **self._payload_base)
+        if _LOG_ENABLED:
+            ApiLog(f"opsgenie call add_note with params: {parameters}, body: {body}")
+        return await self._alert_update_call(add_note, body=body, **parameters)
+
+    async def unack_alert(self, parameters: dict | None = None, note: str = ""):
+        parameters = parameters or {}
+        body = AlertActionPayload(note=note, **self._payload_base)
+        return await self._alert_update_call(
+            un_acknowledge_alert, body=body, **parameters
         )
-        parameters["body"] = body
-        return await self.api_call(close_alert, **parameters)
+
+    async def close_alert(self, parameters: dict | None = None, note: str = ""):
+        parameters = parameters or {}
+        body = AlertActionPayload(note=note, **self._payload_base)
+        return await self._alert_update_call(close_alert, body=body, **parameters)
 
     async def tag_alert(
-        self, parameters: dict = {}, tags: list[str] = [], note: str = ""
+        self,
+        parameters: dict | None = None,
+        tags: list[str] | None = None,
+        note: str = "",
     ):
-        body = AddTagsToAlertPayload(
-            user=self.username, source=self.source, note=note, tags=tags
-        )
-        parameters["body"] = body
-        return await self.api_call(add_tags, **parameters)
+        parameters = parameters or {}
+        body = AddTagsToAlertPayload(tags=tags or [], note=note, **self._payload_base)
+        return await self._alert_update_call(add_tags, body=body, **parameters)
 
     async def remove_tag_alert(
-        self, parameters: dict = {}, tags: list[str] = [], note: str = ""
+        self,
+        parameters: dict | None = None,
+        tags: list[str] | None = None,
+        note: str = "",
     ):
+        parameters = parameters or {}
         # There is no RemoveTagsToAlertPayload
         params = {
-            "user": self.username,
-            "source": self.source,
-            "tags": tags,
+            **self._payload_base,
+            "tags": tags or [],
             "note": note,
             "identifier": parameters["identifier"],
         }
-        return await self.api_call(remove_tags, **params)
+        return await self._alert_update_call(remove_tags, **params)
 
     async def list_schedules(self):
         return await self.api_call(list_schedules)
 
-    async def whois_on_call(self, parameters: dict = {}):
-        params = {"flat": True, "date": pendulum.now()} | parameters
+    async def whois_on_call(self, parameters: dict | None = None):
+        params = dict(parameters) if parameters else {}
+        params.setdefault("flat", True)
+        if "date" not in params:
+            params["date"] = datetime.now(timezone.utc)
         return await self.api_call(get_on_calls, **params)
 
+    async def gather_calls(self, calls: list[tuple[Callable, dict]]) -> list:
+        """Run several API calls concurrently on the shared client
+
+        Results are returned in the order of calls. A call which was cancelled
+        or failed like api_call does is replaced by None, other errors are
+        raised.
+        """
+        results = await asyncio.gather(
+            *(method(**kwargs) for method, kwargs in calls), return_exceptions=True
+        )
+        for index, result in enumerate(results):
+            if isinstance(result, asyncio.CancelledError):
+                if _LOG_ENABLED:
+                    ApiLog("Gathered API call cancelled")
+                results[index] = None
+            elif isinstance(result, API_CALL_EXCEPTIONS):
+                if _LOG_ENABLED:
+                    ApiLog(f"Exception in gathered API call: {result}")
+                results[index] = None
+            elif isinstance(result, BaseException):
+                raise result
+        return results
+
+    def _retry_delay(
+        self, attempt: int, retry_after: str | None = None
+    ) -> float | None:
+        """Delay before the next attempt, None if we should not retry"""
+        delay = 0.25 * 2**attempt + random.random() * 0.1
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                # Retry-After given as an HTTP date, keep the backoff delay
+                pass
+        if delay > API_CALL_MAX_RETRY_DELAY:
+            # Retrying sooner than asked would only be rejected again
+            return None
+        return delay
+
     async def api_call(self, resource, **kwargs):
 
-        response = None
-        try:
-            ApiLog(f"API call {resource.__name__} with params {kwargs}")
-            response = await getattr(resource, "asyncio_detailed")(
-                client=self.client, **kwargs
-            )
-            ApiLog(f"API status code: {response.status_code}")
-            ApiLog(f"API content: {response.content}")
-            ApiLog(f"API call {resource.__name__} done")
-            return response.parsed
-        except Exception as e:
-            ApiLog(f"Exception in API call: {e}")
-            return response
+        for attempt in range(API_CALL_ATTEMPTS):
+            if _LOG_ENABLED:
+                ApiLog(f"API call {resource.__name__} with params {kwargs}")
+            # Calling the endpoint with invalid arguments raises here, before
+            # any request is sent, and is a programming error
+            call = self._endpoints[resource](**kwargs)
+            try:
+                response = await call
+                if _LOG_ENABLED:
+                    ApiLog(f"API status code: {response.status_code}")
+                    ApiLog(f"API content: {response.content}")
+                    ApiLog(f"API call {resource.__name__} done")
+            except RETRYABLE_EXCEPTIONS as e:
+                if _LOG_ENABLED:
+                    ApiLog(f"Unable to send API call {resource.__name__}: {e}")
+                delay = self._retry_delay(attempt)
+            except API_CALL_EXCEPTIONS as e:
+                if _LOG_ENABLED:
+                    ApiLog(f"Exception in API call: {e}")
+                return None
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response.parsed
+                delay = self._retry_delay(
+                    attempt, response.headers.get("Retry-After", None)
+                )
+
+            if delay is None:
+                if _LOG_ENABLED:
+                    ApiLog(
+                        f"API call {resource.__name__} not retried, "
+                        f"Retry-After is over {API_CALL_MAX_RETRY_DELAY}s"
+                    )
+                return None
+
+            if attempt < API_CALL_ATTEMPTS - 1:
+                if _LOG_ENABLED:
+                    ApiLog(f"Retrying API call {resource.__name__} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        if _LOG_ENABLED:
+            ApiLog(f"API call {resource.__name__} failed after {attempt + 1} attempts")
+        return None
 
 
 class Query:
 
     def __init__(self) -> None:
-        self._limit: int = 22
+        self.limit: int = 22
         self.sort: str = "createdAt"
         self.order: str = "desc"
         self.query: str = "status:open"
         self.offset: int = 0
         self.current_filter: str | None = None
+        # filter name => filter query, cleared on each configuration load
+        self._filter_cache: dict[str, str] = {}
+        ty_config.register_load_callback(self._load_config)
         self.current: dict = self.get()
 
-    @property
-    def limit(self) -> int:
-        self._limit: int = int(ty_config.tygenie["alerts"].get("limit", 22))
-        return self._limit
-
-    @limit.setter
-    def limit(self, value=0) -> int:
-        self._limit: int = value or int(ty_config.tygenie["alerts"].get("limit", 22))
-        return self._limit
+    def _load_config(self, config: Config = ty_config) -> None:
+        self.limit = int(config.tygenie["alerts"].get("limit", 22))
+        self._filter_cache.clear()
 
     def _get_query(self, filter_name: str | None = None) -> str:
         query: str = ""
@@ -190,19 +513,25 @@ class Query:
             else:
                 filter_name = ty_config.tygenie.get("default_filter", None)
 
-        if filter_name is not None:
+        if filter_name is not None and filter_name in self._filter_cache:
+            query = self._filter_cache[filter_name]
+        elif filter_name is not None:
             filters: dict = ty_config.tygenie.get("filters", {})
             cust_filter: dict | None = filters.get(filter_name, None)
             if cust_filter is None:
-                ApiLog(f"Custom filter '{filter_name}' not found")
+                if _LOG_ENABLED:
+                    ApiLog(f"Custom filter '{filter_name}' not found")
             else:
                 query = cust_filter.get("filter", "")
+                self._filter_cache[filter_name] = query
 
         self.current_filter = filter_name
 
         return query
 
-    def get(self, filter_name: str | None = None, parameters: dict = {}) -> dict:
+    def get(
+        self, filter_name: str | None = None, parameters: dict | None = None
+    ) -> dict:
         query: str = self._get_query(filter_name=filter_name)
         params: dict = {
             "limit": self.limit,
@@ -211,7 +540,9 @@ class Query:
             "offset": self.offset,
             "query": query,
         }
-        return params | parameters
+        if parameters:
+            params.update(parameters)
+        return params
 
     def current_page(self) -> int:
         return int(self.offset / self.limit) + 1
@@ -225,24 +556,49 @@ class Query:
         return self.get(parameters={"offset": max(0, self.offset)})
 
 
-class OpsgenieClient(OpsGenie):
+class OpsgenieClient:
 
     def __init__(self) -> None:
-        self.api: OpsGenie = OpsGenie()
+        self.api: OpsGenie
+        # Keep a reference on pending closes, the event loop only holds weak ones
+        self._closing_tasks: set[asyncio.Task] = set()
         self._load()
-        super().__init__()
+
+    def _close_client(self, client: AuthenticatedClient) -> None:
+        # The httpx client is built lazily, only close it if it was used
+        if client._async_client is None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(client._async_client.aclose())
+        else:
+            task = loop.create_task(client._async_client.aclose())
+            self._closing_tasks.add(task)
+            task.add_done_callback(self._closing_tasks.discard)
 
     def _load(self) -> None:
-        self.api = OpsGenie(
-            **{
-                k: ty_config.opsgenie.get(k, None)
-                for k in ["username", "host", "api_key"]
-            }
-        )
+        params = {
+            k: ty_config.opsgenie.get(k, None) for k in ["username", "host", "api_key"]
+        }
+        key = (params["host"], params["api_key"])
+        if key not in _client_cache:
+            # Credentials changed, the previous pool is no longer usable
+            for old_client in _client_cache.values():
+                self._close_client(old_client)
+            _client_cache.clear()
+            self.api = OpsGenie(**params)
+            _client_cache[key] = self.api.client
+        else:
+            self.api = OpsGenie(client=_client_cache[key], **params)
 
     def reload(self) -> None:
         self._load()
 
+    async def aclose(self) -> None:
+        await self.api.aclose()
+
 
 client = OpsgenieClient()
 